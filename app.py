@@ -4,7 +4,10 @@ import asyncio
 from datetime import datetime
 import logging
 from config import verify_webhook
-from messenger_api import handle_message
+from messenger_api import handle_message, send_text_message
+from pages import load_pages, get_page, get_page_stats, get_max_users_total
+from user_states import get_conversation_stats
+from circuit_breaker import get_breaker_stats
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -12,6 +15,11 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+BUSY_MESSAGE = "Je reçois beaucoup de messages en ce moment. Veuillez renvoyer le vôtre dans quelques instants."
+
+# Charger le registre des Pages au démarrage
+load_pages()
+
 @app.before_request
 def log_request_info():
     logger.info(f"{datetime.now().isoformat()} - {request.method} {request.url}")
@@ -25,6 +33,27 @@ def webhook_verification():
     response, status_code = verify_webhook(request)
     return response, status_code
 
+def process_event(page, sender_id, message):
+    """
+    Traite un message ou un postback dans les quotas de la Page.
+    Si la Page est saturée, l'utilisateur reçoit une réponse courte, elle-même
+    limitée pour qu'une Page inondée ne monopolise pas les workers.
+    """
+    # Quotas de la Page: une Page saturée ne bloque pas les autres
+    if not page.acquire():
+        if page.allow_busy_reply(sender_id):
+            logger.warning(f"Quota exceeded for page {page.page_id}, sending busy reply to {sender_id}")
+            asyncio.run(send_text_message(page, sender_id, BUSY_MESSAGE))
+        else:
+            logger.warning(f"Quota exceeded for page {page.page_id}, event from {sender_id} dropped")
+        return False
+    
+    try:
+        asyncio.run(handle_message(page, sender_id, message))
+    finally:
+        page.release()
+    return True
+
 @app.route('/api/webhook', methods=['POST'])
 def webhook_handler():
     logger.info("POST request received from webhook")
@@ -37,6 +66,12 @@ def webhook_handler():
                 webhook_event = entry['messaging'][0]
                 logger.info(f"Webhook event received: {json.dumps(webhook_event)}")
                 
+                # Router l'événement vers la Page destinataire
+                page = get_page(entry.get('id'))
+                if page is None:
+                    logger.warning(f"Event for unknown page {entry.get('id')}, ignored")
+                    continue
+                
                 sender_id = webhook_event.get('sender', {}).get('id')
                 
                 # Vérifier si c'est un message ou un postback
@@ -44,8 +79,8 @@ def webhook_handler():
                     logger.info("Message received, calling handle_message")
                     try:
                         # Exécuter handle_message de manière asynchrone
-                        asyncio.run(handle_message(sender_id, webhook_event['message']))
-                        logger.info("handle_message completed successfully")
+                        if process_event(page, sender_id, webhook_event['message']):
+                            logger.info("handle_message completed successfully")
                     except Exception as e:
                         logger.error(f"Error processing message: {e}")
                 
@@ -53,8 +88,8 @@ def webhook_handler():
                     logger.info("Postback received, calling handle_message with postback")
                     try:
                         # Traiter le postback comme un message spécial
-                        asyncio.run(handle_message(sender_id, {'postback': webhook_event['postback']}))
-                        logger.info("handle_message for postback completed successfully")
+                        if process_event(page, sender_id, {'postback': webhook_event['postback']}):
+                            logger.info("handle_message for postback completed successfully")
                     except Exception as e:
                         logger.error(f"Error processing postback: {e}")
                 
@@ -68,6 +103,15 @@ def webhook_handler():
         logger.info("Unrecognized request received")
         return "", 404
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "pages": get_page_stats(),
+        "max_users_total": get_max_users_total(),
+        "conversations": get_conversation_stats(),
+        "circuit_breakers": get_breaker_stats()
+    }), 200
+
 @app.errorhandler(Exception)
 def handle_error(e):
     logger.error(f"Unhandled error: {e}")
@@ -0,0 +1,196 @@
+# Disjoncteurs (circuit breakers) pour les dépendances externes
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from http.client import HTTPException
+from urllib.error import URLError
+
+logger = logging.getLogger(__name__)
+
+# États possibles
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Registre de tous les disjoncteurs, pour les métriques
+breakers = {}
+
+class CircuitOpenError(Exception):
+    """Levée quand un appel est court-circuité parce que le disjoncteur est ouvert"""
+
+    def __init__(self, name):
+        super().__init__(f"Circuit '{name}' ouvert, appel court-circuité")
+        self.name = name
+
+class DependencyError(Exception):
+    """Réponse d'une dépendance indiquant qu'elle est dégradée (429, 5xx)"""
+
+# Exceptions comptées comme des pannes par défaut: les erreurs propres à la
+# requête (vidéo privée, paramètres invalides...) ne doivent pas ouvrir le circuit
+NETWORK_EXCEPTIONS = (DependencyError, TimeoutError, FutureTimeoutError, ConnectionError, URLError, HTTPException)
+
+class BreakerCall:
+    """
+    Appel en cours sous un disjoncteur. `generation` identifie l'état du
+    disjoncteur au moment de l'appel; `start()` permet de ne mesurer la
+    latence qu'à partir du début effectif du travail (hors file d'attente).
+    """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.started_at = time.monotonic()
+        self.started = threading.Event()
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.started.set()
+
+class CircuitBreaker:
+    """
+    Disjoncteur basé sur une fenêtre glissante d'erreurs et de latences.
+    S'ouvre quand le taux d'erreurs ou d'appels lents dépasse son seuil,
+    puis laisse passer un appel d'essai (demi-ouvert) après open_seconds.
+    Seules les exceptions de failure_exceptions sont comptées comme des pannes.
+    """
+
+    def __init__(self, name, window_seconds=60, min_calls=5, failure_rate_threshold=0.5,
+                 slow_call_seconds=10.0, slow_call_rate_threshold=0.8, open_seconds=30,
+                 half_open_max_calls=1, failure_exceptions=NETWORK_EXCEPTIONS):
+        self.name = name
+        self.failure_exceptions = failure_exceptions
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CLOSED
+        self.opened_at = None
+        self.half_open_calls = 0
+        self.half_open_started_at = None
+        # Incrémentée à chaque changement d'état: les résultats d'appels
+        # lancés sous un autre état sont ignorés
+        self.generation = 0
+        self.short_circuited = 0
+        # (horodatage, succès, latence)
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+        breakers[name] = self
+
+    def _prune(self, now):
+        while self.calls and now - self.calls[0][0] > self.window_seconds:
+            self.calls.popleft()
+
+    def _transition(self, state, now):
+        logger.warning(f"Disjoncteur {self.name}: {self.state} -> {state}")
+        self.state = state
+        self.generation += 1
+        self.half_open_calls = 0
+        self.half_open_started_at = now if state == HALF_OPEN else None
+        if state == OPEN:
+            self.opened_at = now
+        elif state == CLOSED:
+            self.opened_at = None
+            self.calls.clear()
+
+    def before_call(self):
+        """
+        Vérifie que l'appel est autorisé et retourne son BreakerCall,
+        lève CircuitOpenError sinon
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN, now)
+            elif (self.state == HALF_OPEN and self.half_open_calls >= self.half_open_max_calls
+                    and now - self.half_open_started_at >= self.open_seconds):
+                # L'appel d'essai n'a jamais abouti: le considérer comme un échec
+                self._transition(OPEN, now)
+
+            if self.state == OPEN or (self.state == HALF_OPEN and self.half_open_calls >= self.half_open_max_calls):
+                self.short_circuited += 1
+                raise CircuitOpenError(self.name)
+
+            if self.state == HALF_OPEN:
+                self.half_open_calls += 1
+            return BreakerCall(self.generation)
+
+    def record(self, call, success, latency):
+        """Enregistre le résultat d'un appel et met à jour l'état"""
+        with self.lock:
+            if call.generation != self.generation:
+                # Résultat tardif d'un appel lancé sous un état précédent
+                return
+
+            now = time.monotonic()
+            slow = latency >= self.slow_call_seconds
+
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED if success and not slow else OPEN, now)
+                return
+
+            self.calls.append((now, success, latency))
+            self._prune(now)
+
+            total = len(self.calls)
+            if total < self.min_calls:
+                return
+
+            failures = sum(1 for _, ok, _ in self.calls if not ok)
+            slow_calls = sum(1 for _, _, duration in self.calls if duration >= self.slow_call_seconds)
+            if failures / total >= self.failure_rate_threshold or slow_calls / total >= self.slow_call_rate_threshold:
+                self._transition(OPEN, now)
+
+    def cancel(self, call):
+        """Libère le créneau d'un appel dont le résultat n'est pas enregistré"""
+        with self.lock:
+            if call.generation == self.generation and self.state == HALF_OPEN and self.half_open_calls > 0:
+                self.half_open_calls -= 1
+
+    @contextmanager
+    def guard(self):
+        """
+        Encadre un appel à la dépendance: court-circuite si le disjoncteur est ouvert,
+        sinon mesure la latence et enregistre le succès ou l'échec. Les autres
+        exceptions sont propagées sans être enregistrées.
+        """
+        call = self.before_call()
+        try:
+            yield call
+        except self.failure_exceptions:
+            self.record(call, False, time.monotonic() - call.started_at)
+            raise
+        except BaseException:
+            self.cancel(call)
+            raise
+        self.record(call, True, time.monotonic() - call.started_at)
+
+    def stats(self):
+        """Retourne l'état du disjoncteur et les statistiques de la fenêtre courante"""
+        with self.lock:
+            now = time.monotonic()
+            self._prune(now)
+            total = len(self.calls)
+            failures = sum(1 for _, ok, _ in self.calls if not ok)
+            latencies = sorted(duration for _, _, duration in self.calls)
+            return {
+                "state": self.state,
+                "calls": total,
+                "failures": failures,
+                "failure_rate": failures / total if total else 0.0,
+                "slow_calls": sum(1 for duration in latencies if duration >= self.slow_call_seconds),
+                "p50_latency": latencies[total // 2] if total else None,
+                "max_latency": latencies[-1] if total else None,
+                "short_circuited": self.short_circuited,
+                "open_for_seconds": now - self.opened_at if self.opened_at is not None else None
+            }
+
+def get_breaker_stats():
+    """Retourne les statistiques de tous les disjoncteurs enregistrés"""
+    return {name: breaker.stats() for name, breaker in breakers.items()}
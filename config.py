@@ -5,6 +5,9 @@ load_dotenv()
 
 MESSENGER_VERIFY_TOKEN = os.environ.get('MESSENGER_VERIFY_TOKEN')
 MESSENGER_PAGE_ACCESS_TOKEN = os.environ.get('MESSENGER_PAGE_ACCESS_TOKEN')
+MESSENGER_PAGE_ID = os.environ.get('MESSENGER_PAGE_ID')
+# Registre multi-Pages (liste JSON), prioritaire sur MESSENGER_PAGE_ACCESS_TOKEN
+MESSENGER_PAGES = os.environ.get('MESSENGER_PAGES')
 MISTRAL_API_KEY = os.environ.get('MISTRAL_API_KEY')
 
 def verify_webhook(request):
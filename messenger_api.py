@@ -1,13 +1,14 @@
-import requests
 import json
 import logging
 import re
 import os
-from config import MESSENGER_PAGE_ACCESS_TOKEN
-from mistral_api import generate_mistral_response
+from mistral_api import generate_mistral_response, TIMEOUT_RESPONSE, ERROR_RESPONSE, UNAVAILABLE_RESPONSE
 from youtube_api import search_youtube, download_youtube_video
+from circuit_breaker import CircuitOpenError, DependencyError
+from pages import GRAPH_API_URL, GRAPH_TIMEOUT, GRAPH_UPLOAD_TIMEOUT
 from user_states import (
     set_user_state, get_user_state, clear_user_state,
+    add_conversation_exchange, build_conversation_context, clear_conversation,
     NORMAL, WAITING_FOR_YOUTUBE_QUERY
 )
 
@@ -18,15 +19,16 @@ logger = logging.getLogger(__name__)
 # Commandes
 YT_COMMAND = "/yt"
 CANCEL_COMMAND = "/cancel"
+RESET_COMMAND = "/reset"
 
-async def handle_message(sender_id, received_message):
-    """Gère les messages reçus du Messenger"""
-    logger.info(f"Début de handle_message pour sender_id: {sender_id}")
+async def handle_message(page, sender_id, received_message):
+    """Gère les messages reçus du Messenger pour une Page donnée"""
+    logger.info(f"Début de handle_message pour sender_id: {sender_id} (Page {page.page_id})")
     logger.info(f"Message reçu: {json.dumps(received_message)}")
     
     try:
         # Récupérer l'état actuel de l'utilisateur
-        current_state, state_data = get_user_state(sender_id)
+        current_state, state_data = get_user_state(sender_id, namespace=page.page_id)
         
         # Vérifier si c'est un message texte
         if "text" in received_message:
@@ -34,70 +36,88 @@ async def handle_message(sender_id, received_message):
             
             # Commande d'annulation
             if message_text.lower() == CANCEL_COMMAND:
-                clear_user_state(sender_id)
-                await send_text_message(sender_id, "Commande annulée. Comment puis-je vous aider ?")
+                clear_user_state(sender_id, namespace=page.page_id)
+                await send_text_message(page, sender_id, "Commande annulée. Comment puis-je vous aider ?")
+                return
+            
+            # Commande d'oubli de l'historique de conversation
+            if message_text.lower() == RESET_COMMAND:
+                clear_user_state(sender_id, namespace=page.page_id)
+                clear_conversation(sender_id, namespace=page.page_id)
+                await send_text_message(page, sender_id, "Conversation réinitialisée. J'ai oublié nos échanges précédents.")
                 return
             
             # Commande YouTube
             if message_text.lower() == YT_COMMAND:
-                set_user_state(sender_id, WAITING_FOR_YOUTUBE_QUERY)
-                await send_text_message(sender_id, "Bienvenue dans JekleTube ! Donnez-moi les mots clés pour rechercher une vidéo.")
+                set_user_state(sender_id, WAITING_FOR_YOUTUBE_QUERY, namespace=page.page_id, max_users=page.max_users)
+                await send_text_message(page, sender_id, "Bienvenue dans JekleTube ! Donnez-moi les mots clés pour rechercher une vidéo.")
                 return
             
             # Traitement selon l'état
             if current_state == WAITING_FOR_YOUTUBE_QUERY:
-                await handle_youtube_search_query(sender_id, message_text)
+                await handle_youtube_search_query(page, sender_id, message_text)
                 return
             
             # Message normal, utiliser Mistral AI
             logger.info("Génération de la réponse Mistral...")
-            response = generate_mistral_response(message_text)
+            history = build_conversation_context(sender_id, namespace=page.page_id)
+            response = generate_mistral_response(message_text, history)
             logger.info(f"Réponse Mistral générée: {response}")
-            await send_text_message(sender_id, response)
+            
+            # Mémoriser l'échange (sauf les messages d'erreur)
+            if response not in (TIMEOUT_RESPONSE, ERROR_RESPONSE, UNAVAILABLE_RESPONSE):
+                add_conversation_exchange(sender_id, message_text, response, namespace=page.page_id, max_users=page.max_users)
+            
+            await send_text_message(page, sender_id, response)
             logger.info("Message envoyé avec succès")
         
         # Vérifier si c'est un postback (clic sur un bouton)
         elif "postback" in received_message:
-            await handle_postback(sender_id, received_message["postback"])
+            await handle_postback(page, sender_id, received_message["postback"])
         
         else:
             logger.info("Message reçu sans texte ni postback")
-            await send_text_message(sender_id, "Désolé, je ne peux traiter que des messages texte.")
+            await send_text_message(page, sender_id, "Désolé, je ne peux traiter que des messages texte.")
     
     except Exception as e:
         logger.error(f"Erreur lors du traitement du message: {e}")
         error_message = "Désolé, j'ai rencontré une erreur en traitant votre message. Veuillez réessayer plus tard."
         if "timeout" in str(e).lower():
             error_message = "Désolé, la génération de la réponse a pris trop de temps. Veuillez réessayer avec une question plus courte ou plus simple."
-        await send_text_message(sender_id, error_message)
+        await send_text_message(page, sender_id, error_message)
     
     logger.info("Fin de handle_message")
 
-async def handle_youtube_search_query(sender_id, query):
+async def handle_youtube_search_query(page, sender_id, query):
     """Gère une recherche YouTube"""
     try:
-        await send_text_message(sender_id, f"Recherche de vidéos pour: {query}...")
+        await send_text_message(page, sender_id, f"Recherche de vidéos pour: {query}...")
         
         # Rechercher les vidéos
         results = search_youtube(query, limit=5)
         
         if not results:
-            await send_text_message(sender_id, "Aucun résultat trouvé pour cette recherche.")
-            clear_user_state(sender_id)
+            await send_text_message(page, sender_id, "Aucun résultat trouvé pour cette recherche.")
+            clear_user_state(sender_id, namespace=page.page_id)
             return
         
         # Envoyer les résultats avec des boutons
-        await send_youtube_results(sender_id, results)
+        await send_youtube_results(page, sender_id, results)
         
         # Réinitialiser l'état
-        clear_user_state(sender_id)
+        clear_user_state(sender_id, namespace=page.page_id)
+    
+    except CircuitOpenError:
+        logger.warning("Recherche YouTube court-circuitée, service dégradé")
+        await send_text_message(page, sender_id, "La recherche YouTube est momentanément indisponible. Veuillez réessayer dans quelques instants.")
+        clear_user_state(sender_id, namespace=page.page_id)
     
     except Exception as e:
         logger.error(f"Erreur lors de la recherche YouTube: {e}")
-        await send_text_message(sender_id, "Désolé, une erreur s'est produite lors de la recherche YouTube.")
-        clear_user_state(sender_id)
+        await send_text_message(page, sender_id, "Désolé, une erreur s'est produite lors de la recherche YouTube.")
+        clear_user_state(sender_id, namespace=page.page_id)
 
-async def handle_postback(sender_id, postback):
+async def handle_postback(page, sender_id, postback):
     """Gère les postbacks (clics sur boutons)"""
     logger.info(f"Postback reçu: {json.dumps(postback)}")
     
@@ -107,22 +127,23 @@ async def handle_postback(sender_id, postback):
         # Vérifier si c'est un postback pour regarder une vidéo
         if payload.startswith("WATCH_VIDEO:"):
             video_id = payload.split("WATCH_VIDEO:")[1]
-            await handle_watch_video(sender_id, video_id)
+            await handle_watch_video(page, sender_id, video_id)
     
     except Exception as e:
         logger.error(f"Erreur lors du traitement du postback: {e}")
-        await send_text_message(sender_id, "Désolé, une erreur s'est produite lors du traitement de votre action.")
+        await send_text_message(page, sender_id, "Désolé, une erreur s'est produite lors du traitement de votre action.")
 
-async def handle_watch_video(sender_id, video_id):
+async def handle_watch_video(page, sender_id, video_id):
     """Gère la demande de visionnage d'une vidéo"""
     try:
-        await send_text_message(sender_id, "Téléchargement de la vidéo en cours... Cela peut prendre quelques instants.")
+        await send_text_message(page, sender_id, "Téléchargement de la vidéo en cours... Cela peut prendre quelques instants.")
         
         # Télécharger la vidéo
         video_path, file_size_mb = download_youtube_video(video_id)
         
         if file_size_mb > 25:
             await send_text_message(
+                page,
                 sender_id, 
                 f"Désolé, la vidéo est trop volumineuse ({file_size_mb:.1f} Mo) pour être envoyée via Messenger (limite de 25 Mo). "
                 f"Voici le lien YouTube: https://www.youtube.com/watch?v={video_id}"
@@ -130,7 +151,7 @@ async def handle_watch_video(sender_id, video_id):
             return
         
         # Envoyer la vidéo
-        await send_video_attachment(sender_id, video_path)
+        await send_video_attachment(page, sender_id, video_path)
         
         # Supprimer le fichier temporaire
         try:
@@ -142,12 +163,13 @@ async def handle_watch_video(sender_id, video_id):
     except Exception as e:
         logger.error(f"Erreur lors du téléchargement/envoi de la vidéo: {e}")
         await send_text_message(
+            page,
             sender_id, 
             "Désolé, une erreur s'est produite lors du téléchargement de la vidéo. "
             f"Voici le lien YouTube: https://www.youtube.com/watch?v={video_id}"
         )
 
-async def send_youtube_results(sender_id, results):
+async def send_youtube_results(page, sender_id, results):
     """Envoie les résultats de recherche YouTube avec des boutons"""
     try:
         elements = []
@@ -187,14 +209,14 @@ async def send_youtube_results(sender_id, results):
             }
         }
         
-        await call_send_api(message_data)
+        await call_send_api(page, message_data)
         logger.info("Résultats YouTube envoyés avec succès")
     
     except Exception as e:
         logger.error(f"Erreur lors de l'envoi des résultats YouTube: {e}")
-        await send_text_message(sender_id, "Désolé, une erreur s'est produite lors de l'affichage des résultats.")
+        await send_text_message(page, sender_id, "Désolé, une erreur s'est produite lors de l'affichage des résultats.")
 
-async def send_video_attachment(sender_id, video_path):
+async def send_video_attachment(page, sender_id, video_path):
     """Envoie une vidéo en pièce jointe"""
     try:
         # Vérifier si le fichier existe
@@ -206,9 +228,6 @@ async def send_video_attachment(sender_id, video_path):
         if file_size_mb > 25:
             raise ValueError(f"Le fichier est trop volumineux: {file_size_mb:.2f} Mo (limite: 25 Mo)")
         
-        # URL pour l'upload de pièces jointes
-        url = f"https://graph.facebook.com/v13.0/me/messages?access_token={MESSENGER_PAGE_ACCESS_TOKEN}"
-        
         # Préparer les données multipart
         files = {
             'filedata': (os.path.basename(video_path), open(video_path, 'rb'), 'video/mp4')
@@ -227,7 +246,10 @@ async def send_video_attachment(sender_id, video_path):
         }
         
         # Envoyer la requête
-        response = requests.post(url, files=files, data=payload)
+        with page.graph_upload_breaker.guard():
+            response = page.session.post(GRAPH_API_URL, files=files, data=payload, timeout=GRAPH_UPLOAD_TIMEOUT)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise DependencyError(f"Erreur HTTP: {response.status_code}")
         
         # Vérifier la réponse
         if response.status_code != 200:
@@ -245,7 +267,7 @@ async def send_video_attachment(sender_id, video_path):
         logger.error(f"Erreur lors de l'envoi de la vidéo: {e}")
         raise
 
-async def send_text_message(recipient_id, message_text):
+async def send_text_message(page, recipient_id, message_text):
     """Envoie un message texte à un utilisateur Messenger"""
     logger.info(f"Début de send_text_message pour recipient_id: {recipient_id}")
     logger.info(f"Message à envoyer: {message_text}")
@@ -264,24 +286,27 @@ async def send_text_message(recipient_id, message_text):
         }
         
         try:
-            await call_send_api(message_data)
+            await call_send_api(page, message_data)
         except Exception as e:
             logger.error(f"Erreur lors de l'envoi du message: {e}")
             raise  # Propager l'erreur pour la gestion dans handle_message
     
     logger.info("Fin de send_text_message")
 
-async def call_send_api(message_data):
+async def call_send_api(page, message_data):
     """Appelle l'API Send de Facebook Messenger"""
     logger.info(f"Début de call_send_api avec message_data: {json.dumps(message_data)}")
-    url = f"https://graph.facebook.com/v13.0/me/messages?access_token={MESSENGER_PAGE_ACCESS_TOKEN}"
-    
     try:
-        response = requests.post(
-            url,
-            headers={"Content-Type": "application/json"},
-            json=message_data
-        )
+        # Seules les erreurs réseau, la limitation (429) et les erreurs serveur comptent pour le disjoncteur
+        with page.graph_breaker.guard():
+            response = page.session.post(
+                GRAPH_API_URL,
+                headers={"Content-Type": "application/json"},
+                json=message_data,
+                timeout=GRAPH_TIMEOUT
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                raise DependencyError(f"Erreur HTTP: {response.status_code}")
         
         logger.info(f"Réponse reçue de l'API Facebook. Status: {response.status_code}")
         
@@ -2,6 +2,17 @@ import re
 import requests
 import json
 from config import MISTRAL_API_KEY
+from circuit_breaker import CircuitBreaker, CircuitOpenError, DependencyError, NETWORK_EXCEPTIONS
+
+mistral_breaker = CircuitBreaker(
+    "mistral",
+    slow_call_seconds=20.0,
+    failure_exceptions=NETWORK_EXCEPTIONS + (requests.exceptions.RequestException,)
+)
+
+TIMEOUT_RESPONSE = "Désolé, la génération de la réponse a pris trop de temps. Veuillez réessayer avec une question plus courte ou plus simple."
+ERROR_RESPONSE = "Je suis désolé, mais je ne peux pas répondre pour le moment. Veuillez réessayer plus tard."
+UNAVAILABLE_RESPONSE = "Je suis momentanément indisponible en raison d'une forte demande. Veuillez réessayer dans quelques instants."
 
 def check_creator_question(prompt):
     lower_prompt = prompt.lower()
@@ -17,7 +28,11 @@ def check_creator_question(prompt):
             return True
     return False
 
-def generate_mistral_response(prompt):
+def generate_mistral_response(prompt, history=None):
+    """
+    Génère une réponse Mistral. `history` contient les messages précédents
+    (résumé et tours récents) déjà limités par le budget de tokens.
+    """
     print(f"Starting generate_mistral_response for prompt: {prompt}")
     
     # Check if the question is about the creator
@@ -27,19 +42,25 @@ def generate_mistral_response(prompt):
     
     try:
         print("Sending request to Mistral API...")
-        response = requests.post(
-            "https://api.mistral.ai/v1/chat/completions",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {MISTRAL_API_KEY}"
-            },
-            json={
-                "model": "mistral-large-latest",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1000
-            },
-            timeout=50  # 50 seconds timeout
-        )
+        with mistral_breaker.guard():
+            response = requests.post(
+                "https://api.mistral.ai/v1/chat/completions",
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {MISTRAL_API_KEY}"
+                },
+                json={
+                    "model": "mistral-large-latest",
+                    "messages": (history or []) + [{"role": "user", "content": prompt}],
+                    "max_tokens": 1000
+                },
+                timeout=50  # 50 seconds timeout
+            )
+            
+            # Seules les erreurs du service (surcharge, 5xx) comptent pour le disjoncteur
+            if response.status_code == 429 or response.status_code >= 500:
+                print(f"Mistral API Error: {response.status_code} - {response.text}")
+                raise DependencyError(f"HTTP error! status: {response.status_code}")
         
         print(f"Response received from Mistral API. Status: {response.status_code}")
         
@@ -58,10 +79,13 @@ def generate_mistral_response(prompt):
         print(f"Generated response: {generated_response}")
         return generated_response
         
+    except CircuitOpenError:
+        print("Mistral circuit open, returning fallback response")
+        return UNAVAILABLE_RESPONSE
     except requests.exceptions.Timeout:
         print("Timeout error during Mistral response generation")
-        return "Désolé, la génération de la réponse a pris trop de temps. Veuillez réessayer avec une question plus courte ou plus simple."
+        return TIMEOUT_RESPONSE
     except Exception as e:
         print(f"Detailed error during Mistral response generation: {e}")
-        return "Je suis désolé, mais je ne peux pas répondre pour le moment. Veuillez réessayer plus tard."
+        return ERROR_RESPONSE
 
@@ -0,0 +1,199 @@
+# Registre des Pages Facebook servies par le bot (multi-tenant)
+import json
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPSConnectionPool
+from config import MESSENGER_PAGES, MESSENGER_PAGE_ID, MESSENGER_PAGE_ACCESS_TOKEN
+from circuit_breaker import CircuitBreaker, NETWORK_EXCEPTIONS
+from user_states import MAX_USERS_IN_MEMORY
+
+logger = logging.getLogger(__name__)
+
+GRAPH_API_URL = "https://graph.facebook.com/v13.0/me/messages"
+
+# Identifiant utilisé quand une seule Page est configurée sans MESSENGER_PAGE_ID
+DEFAULT_PAGE_ID = "default"
+
+# Valeurs par défaut des quotas d'une Page
+DEFAULT_RATE_LIMIT = 10         # Événements par seconde
+DEFAULT_BURST = 20              # Rafale maximale d'événements
+DEFAULT_MAX_CONCURRENT = 4      # Événements traités simultanément
+DEFAULT_POOL_SIZE = 4           # Connexions HTTP simultanées vers l'API Graph
+
+# Au plus une réponse "occupé" par utilisateur et par intervalle (en secondes)
+BUSY_REPLY_INTERVAL = 60
+
+# Délais maximaux (en secondes) des appels à l'API Graph
+GRAPH_TIMEOUT = 10
+GRAPH_UPLOAD_TIMEOUT = 60
+GRAPH_POOL_TIMEOUT = 5          # Attente maximale d'une connexion libre du pool
+
+GRAPH_FAILURE_EXCEPTIONS = NETWORK_EXCEPTIONS + (requests.exceptions.RequestException,)
+
+# Stockage des Pages par identifiant
+pages = {}
+
+class RateLimiter:
+    """Seau à jetons: `rate` jetons par seconde, au plus `burst` en réserve"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class PoolTimeoutHTTPSConnectionPool(HTTPSConnectionPool):
+    """Pool bloquant dont l'attente d'une connexion libre est bornée par GRAPH_POOL_TIMEOUT"""
+
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(timeout=GRAPH_POOL_TIMEOUT if timeout is None else timeout)
+
+class PoolTimeoutAdapter(HTTPAdapter):
+    """
+    HTTPAdapter dont le pool bloque au-delà de pool_maxsize connexions, mais sans
+    attendre indéfiniment: requests ne transmet pas de pool_timeout à urllib3
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            self.poolmanager.pool_classes_by_scheme, https=PoolTimeoutHTTPSConnectionPool
+        )
+
+class Page:
+    """
+    Une Page Facebook avec son jeton d'accès, son client HTTP,
+    ses quotas et son espace de noms pour les états et conversations.
+    """
+
+    def __init__(self, page_id, access_token, name=None, rate_limit=DEFAULT_RATE_LIMIT,
+                 burst=DEFAULT_BURST, max_concurrent=DEFAULT_MAX_CONCURRENT,
+                 pool_size=DEFAULT_POOL_SIZE, max_users=MAX_USERS_IN_MEMORY):
+        self.page_id = page_id
+        self.name = name or page_id
+        self.max_users = max_users
+
+        # Client HTTP dédié: le jeton n'apparaît plus dans les URLs construites à la main
+        self.session = requests.Session()
+        self.session.params = {"access_token": access_token}
+        # pool_block: au-delà de pool_size, attendre une connexion libre (au plus
+        # GRAPH_POOL_TIMEOUT) plutôt qu'en ouvrir une autre
+        self.session.mount("https://", PoolTimeoutAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True))
+
+        self.rate_limiter = RateLimiter(rate_limit, burst)
+        self.max_concurrent = max_concurrent
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        # Les envois de vidéos (jusqu'à 25 Mo) ont leur propre disjoncteur pour
+        # ne pas ouvrir celui des messages texte
+        self.graph_breaker = CircuitBreaker(
+            f"graph:{page_id}", slow_call_seconds=5.0, failure_exceptions=GRAPH_FAILURE_EXCEPTIONS
+        )
+        self.graph_upload_breaker = CircuitBreaker(
+            f"graph_upload:{page_id}", slow_call_seconds=GRAPH_UPLOAD_TIMEOUT, failure_exceptions=GRAPH_FAILURE_EXCEPTIONS
+        )
+
+        self.accepted = 0
+        self.rejected = 0
+        self.busy_replies = 0
+        # Dernière réponse "occupé" envoyée à chaque utilisateur
+        self.busy_replied_at = {}
+        self.counters_lock = threading.Lock()
+
+    def acquire(self):
+        """Réserve un créneau de traitement si les quotas de la Page le permettent"""
+        # Le créneau est pris avant le jeton pour ne pas consommer de jeton en cas de refus
+        accepted = self.slots.acquire(blocking=False)
+        if accepted and not self.rate_limiter.allow():
+            self.slots.release()
+            accepted = False
+
+        with self.counters_lock:
+            if accepted:
+                self.accepted += 1
+            else:
+                self.rejected += 1
+        return accepted
+
+    def release(self):
+        self.slots.release()
+
+    def allow_busy_reply(self, user_id):
+        """
+        Autorise une réponse "occupé" au plus une fois par BUSY_REPLY_INTERVAL et par
+        utilisateur, et seulement si le seau à jetons de la Page le permet
+        """
+        with self.counters_lock:
+            now = time.monotonic()
+            # Oublier les utilisateurs dont l'intervalle est écoulé
+            self.busy_replied_at = {
+                replied_id: replied_at for replied_id, replied_at in self.busy_replied_at.items()
+                if now - replied_at < BUSY_REPLY_INTERVAL
+            }
+            if user_id in self.busy_replied_at or not self.rate_limiter.allow():
+                return False
+            self.busy_replied_at[user_id] = now
+            self.busy_replies += 1
+            return True
+
+    def stats(self):
+        with self.counters_lock:
+            accepted, rejected, busy_replies = self.accepted, self.rejected, self.busy_replies
+        return {
+            "name": self.name,
+            "accepted": accepted,
+            "rejected": rejected,
+            "busy_replies": busy_replies,
+            "max_concurrent": self.max_concurrent,
+            "rate_limit": self.rate_limiter.rate,
+            "max_users": self.max_users
+        }
+
+def load_pages():
+    """
+    Charge le registre des Pages depuis MESSENGER_PAGES (liste JSON), ou à défaut
+    une Page unique à partir de MESSENGER_PAGE_ACCESS_TOKEN.
+    """
+    pages.clear()
+
+    if MESSENGER_PAGES:
+        for page_config in json.loads(MESSENGER_PAGES):
+            page_config = dict(page_config)
+            page_id = str(page_config.pop("id"))
+            pages[page_id] = Page(page_id, **page_config)
+    elif MESSENGER_PAGE_ACCESS_TOKEN:
+        page_id = MESSENGER_PAGE_ID or DEFAULT_PAGE_ID
+        pages[page_id] = Page(page_id, MESSENGER_PAGE_ACCESS_TOKEN)
+
+    logger.info(f"{len(pages)} Page(s) chargée(s): {', '.join(pages)}")
+
+def get_page(page_id):
+    """
+    Retourne la Page correspondant à entry.id, ou None si elle est inconnue.
+    Une Page unique configurée sans identifiant sert toutes les entrées.
+    """
+    page = pages.get(str(page_id))
+    if page is None and list(pages) == [DEFAULT_PAGE_ID]:
+        page = pages[DEFAULT_PAGE_ID]
+    return page
+
+def get_page_stats():
+    """Retourne les compteurs de quotas de toutes les Pages"""
+    return {page_id: page.stats() for page_id, page in pages.items()}
+
+def get_max_users_total():
+    """Retourne le nombre maximal d'utilisateurs suivis, toutes Pages confondues"""
+    return sum(page.max_users for page in pages.values())
@@ -1,5 +1,7 @@
 # Gestion des états utilisateurs pour suivre les conversations
 import logging
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -8,42 +10,258 @@ logger = logging.getLogger(__name__)
 NORMAL = "normal"
 WAITING_FOR_YOUTUBE_QUERY = "waiting_for_youtube_query"
 
-# Stockage des états utilisateurs
+# Espace de noms utilisé quand aucun n'est précisé (une Page Facebook par espace)
+DEFAULT_NAMESPACE = "default"
+
+# Nombre maximal d'utilisateurs suivis par espace de noms
+MAX_USERS_IN_MEMORY = 1000
+
+# Stockage des états utilisateurs par espace de noms, les plus récemment utilisés à la fin
 user_states = {}
+user_states_lock = threading.Lock()
+
+# Limites de la mémoire de conversation
+MAX_EXCHANGES_PER_USER = 5     # Taille du tampon circulaire par utilisateur (échanges question/réponse)
+MAX_TURN_CHARS = 4000          # Longueur maximale d'un tour stocké
+MAX_SUMMARY_CHARS = 1500       # Longueur maximale du résumé glissant
+CONTEXT_TOKEN_BUDGET = 3000    # Budget de tokens pour le contexte envoyé à Mistral
+SUMMARY_LINE_CHARS = 200       # Longueur d'un tour une fois compressé dans le résumé
+CONVERSATION_TTL = timedelta(hours=2)  # Durée d'inactivité avant l'oubli d'une conversation
 
-def set_user_state(user_id, state, data=None):
+# Stockage des conversations par espace de noms, les plus récemment utilisées à la fin
+conversations = {}
+# Flask traite les requêtes dans plusieurs threads
+conversations_lock = threading.Lock()
+
+def set_user_state(user_id, state, data=None, namespace=DEFAULT_NAMESPACE, max_users=MAX_USERS_IN_MEMORY):
     """
     Définit l'état d'un utilisateur
     """
-    user_states[user_id] = {
-        "state": state,
-        "data": data or {},
-        "timestamp": datetime.now()
-    }
-    logger.info(f"État utilisateur défini pour {user_id}: {state}")
+    with user_states_lock:
+        namespace_states = user_states.setdefault(namespace, OrderedDict())
+        namespace_states[user_id] = {
+            "state": state,
+            "data": data or {},
+            "timestamp": datetime.now()
+        }
+        namespace_states.move_to_end(user_id)
+        # Évincer les états les moins récemment définis
+        while len(namespace_states) > max_users:
+            namespace_states.popitem(last=False)
+    logger.info(f"État utilisateur défini pour {user_id} ({namespace}): {state}")
 
-def get_user_state(user_id):
+def get_user_state(user_id, namespace=DEFAULT_NAMESPACE):
     """
     Récupère l'état actuel d'un utilisateur
     """
-    if user_id not in user_states:
-        return NORMAL, {}
-    
-    user_data = user_states[user_id]
-    
-    # Vérifier si l'état a expiré (30 minutes)
-    if datetime.now() - user_data["timestamp"] > timedelta(minutes=30):
-        logger.info(f"État expiré pour l'utilisateur {user_id}, retour à l'état normal")
-        del user_states[user_id]
-        return NORMAL, {}
-    
-    return user_data["state"], user_data["data"]
-
-def clear_user_state(user_id):
+    with user_states_lock:
+        namespace_states = user_states.get(namespace, {})
+        if user_id not in namespace_states:
+            return NORMAL, {}
+        
+        user_data = namespace_states[user_id]
+        
+        # Vérifier si l'état a expiré (30 minutes)
+        if datetime.now() - user_data["timestamp"] > timedelta(minutes=30):
+            logger.info(f"État expiré pour l'utilisateur {user_id} ({namespace}), retour à l'état normal")
+            del namespace_states[user_id]
+            return NORMAL, {}
+        
+        return user_data["state"], user_data["data"]
+
+def clear_user_state(user_id, namespace=DEFAULT_NAMESPACE):
     """
     Réinitialise l'état d'un utilisateur
     """
-    if user_id in user_states:
-        del user_states[user_id]
-        logger.info(f"État utilisateur effacé pour {user_id}")
+    with user_states_lock:
+        namespace_states = user_states.get(namespace, {})
+        if user_id in namespace_states:
+            del namespace_states[user_id]
+            logger.info(f"État utilisateur effacé pour {user_id} ({namespace})")
+
+def estimate_tokens(text):
+    """
+    Estime grossièrement le nombre de tokens d'un texte (~4 caractères par token)
+    """
+    return len(text) // 4 + 1
+
+def _compress_turn(role, content):
+    """
+    Compresse un tour de conversation en une ligne courte pour le résumé
+    """
+    speaker = "Utilisateur" if role == "user" else "Assistant"
+    content = " ".join(content.split())
+    if len(content) > SUMMARY_LINE_CHARS:
+        content = content[:SUMMARY_LINE_CHARS] + "..."
+    return f"{speaker}: {content}"
+
+def _compress_exchange(exchange):
+    """
+    Compresse un échange question/réponse pour le résumé
+    """
+    return f"{_compress_turn('user', exchange['user'])}\n{_compress_turn('assistant', exchange['assistant'])}"
+
+def _exchange_chars(exchange):
+    return len(exchange["user"]) + len(exchange["assistant"])
+
+def _append_to_summary(summary, line):
+    """
+    Ajoute une ligne au résumé en ne conservant que la fin si la limite est dépassée
+    """
+    summary = f"{summary}\n{line}" if summary else line
+    if len(summary) > MAX_SUMMARY_CHARS:
+        summary = summary[-MAX_SUMMARY_CHARS:]
+        # Repartir d'une ligne complète
+        if "\n" in summary:
+            summary = summary.split("\n", 1)[1]
+    return summary
+
+def _prune_expired_conversations(namespace_conversations, now):
+    """
+    Oublie les conversations inactives depuis plus de CONVERSATION_TTL.
+    Elles sont triées de la moins à la plus récemment utilisée.
+    """
+    while namespace_conversations:
+        user_id, conversation = next(iter(namespace_conversations.items()))
+        if now - conversation["timestamp"] <= CONVERSATION_TTL:
+            break
+        del namespace_conversations[user_id]
+        logger.info(f"Conversation expirée pour {user_id}")
 
+def add_conversation_exchange(user_id, user_message, assistant_message, namespace=DEFAULT_NAMESPACE, max_users=MAX_USERS_IN_MEMORY):
+    """
+    Ajoute un échange question/réponse à l'historique d'un utilisateur.
+    L'échange le plus ancien est compressé dans le résumé quand le tampon est plein.
+    Chaque espace de noms est limité à max_users conversations.
+    """
+    with conversations_lock:
+        namespace_conversations = conversations.setdefault(namespace, OrderedDict())
+        _prune_expired_conversations(namespace_conversations, datetime.now())
+        conversation = namespace_conversations.get(user_id)
+        if conversation is None:
+            conversation = {
+                "exchanges": deque(maxlen=MAX_EXCHANGES_PER_USER),
+                "summary": "",
+                "timestamp": datetime.now()
+            }
+            namespace_conversations[user_id] = conversation
+            # Évincer les conversations les moins récemment utilisées
+            while len(namespace_conversations) > max_users:
+                evicted_id, _ = namespace_conversations.popitem(last=False)
+                logger.info(f"Conversation évincée de la mémoire pour {evicted_id} ({namespace})")
+        else:
+            namespace_conversations.move_to_end(user_id)
+            conversation["timestamp"] = datetime.now()
+
+        exchanges = conversation["exchanges"]
+        if len(exchanges) == exchanges.maxlen:
+            conversation["summary"] = _append_to_summary(conversation["summary"], _compress_exchange(exchanges[0]))
+
+        exchanges.append({
+            "user": user_message[:MAX_TURN_CHARS],
+            "assistant": assistant_message[:MAX_TURN_CHARS]
+        })
+        user_chars = len(conversation["summary"]) + sum(_exchange_chars(exchange) for exchange in exchanges)
+
+    logger.info(f"Mémoire de conversation pour {user_id} ({namespace}): {len(exchanges)} échanges, {user_chars} caractères")
+
+def build_conversation_context(user_id, namespace=DEFAULT_NAMESPACE, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Construit la liste de messages à envoyer à Mistral dans la limite du budget de tokens.
+    Les échanges récents sont conservés tels quels, les plus anciens sont résumés.
+    L'historique commence toujours par un message "user" après le résumé.
+    """
+    with conversations_lock:
+        namespace_conversations = conversations.get(namespace, {})
+        conversation = namespace_conversations.get(user_id)
+        if conversation is None:
+            return []
+        if datetime.now() - conversation["timestamp"] > CONVERSATION_TTL:
+            logger.info(f"Conversation expirée pour {user_id} ({namespace})")
+            del namespace_conversations[user_id]
+            return []
+        summary = conversation["summary"]
+        exchanges = list(conversation["exchanges"])
+
+    # Le résumé glissant stocké est toujours conservé
+    budget = token_budget - estimate_tokens(summary)
+
+    # Parcourir les échanges du plus récent au plus ancien
+    recent_exchanges = []
+    overflow = []
+    for exchange in reversed(exchanges):
+        cost = estimate_tokens(exchange["user"]) + estimate_tokens(exchange["assistant"])
+        if not overflow and cost <= budget:
+            recent_exchanges.append(exchange)
+            budget -= cost
+        else:
+            overflow.append(exchange)
+
+    # Les échanges qui ne tiennent pas dans le budget sont compressés,
+    # en gardant les plus récents si la place manque
+    overflow_lines = []
+    for exchange in overflow:
+        lines = _compress_exchange(exchange)
+        cost = estimate_tokens(lines)
+        if cost > budget:
+            break
+        overflow_lines.insert(0, lines)
+        budget -= cost
+
+    summary = "\n".join(part for part in [summary] + overflow_lines if part)
+
+    messages = []
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": f"Résumé des échanges précédents avec l'utilisateur:\n{summary}"
+        })
+    for exchange in reversed(recent_exchanges):
+        messages.append({"role": "user", "content": exchange["user"]})
+        messages.append({"role": "assistant", "content": exchange["assistant"]})
+    return messages
+
+def clear_conversation(user_id, namespace=DEFAULT_NAMESPACE):
+    """
+    Efface l'historique de conversation d'un utilisateur
+    """
+    with conversations_lock:
+        namespace_conversations = conversations.get(namespace, {})
+        if user_id in namespace_conversations:
+            del namespace_conversations[user_id]
+            logger.info(f"Conversation effacée pour {user_id} ({namespace})")
+
+def get_conversation_stats():
+    """
+    Retourne l'utilisation actuelle de la mémoire de conversation et ses limites
+    """
+    total_users = 0
+    total_exchanges = 0
+    total_chars = 0
+    max_user_chars = 0
+    namespaces = {}
+    with conversations_lock:
+        for namespace, namespace_conversations in conversations.items():
+            namespace_chars = 0
+            for conversation in namespace_conversations.values():
+                user_chars = len(conversation["summary"]) + sum(_exchange_chars(exchange) for exchange in conversation["exchanges"])
+                total_exchanges += len(conversation["exchanges"])
+                namespace_chars += user_chars
+                max_user_chars = max(max_user_chars, user_chars)
+            namespaces[namespace] = {"users": len(namespace_conversations), "chars": namespace_chars}
+            total_users += len(namespace_conversations)
+            total_chars += namespace_chars
+
+    return {
+        "users": total_users,
+        "exchanges": total_exchanges,
+        "chars": total_chars,
+        "max_user_chars": max_user_chars,
+        "namespaces": namespaces,
+        "limits": {
+            "max_exchanges_per_user": MAX_EXCHANGES_PER_USER,
+            "max_chars_per_user": MAX_EXCHANGES_PER_USER * 2 * MAX_TURN_CHARS + MAX_SUMMARY_CHARS,
+            "context_token_budget": CONTEXT_TOKEN_BUDGET,
+            "conversation_ttl_seconds": int(CONVERSATION_TTL.total_seconds())
+        }
+    }
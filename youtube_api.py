@@ -4,12 +4,37 @@ from youtubesearchpython import VideosSearch  # Correction de la syntaxe d'impor
 import requests
 import tempfile
 import logging
+import httpx
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from urllib.parse import urlparse, parse_qs
+from circuit_breaker import CircuitBreaker, NETWORK_EXCEPTIONS
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Délais maximaux (en secondes) des appels à YouTube
+SEARCH_TIMEOUT = 10
+DOWNLOAD_SOCKET_TIMEOUT = 15   # Par opération réseau de pytube
+DOWNLOAD_TIMEOUT = 45          # Pour l'ensemble du téléchargement, une fois démarré
+DOWNLOAD_QUEUE_TIMEOUT = 10    # Attente maximale d'un worker libre
+
+# pytube n'a pas de délai global: le travail est fait dans un pool borné
+# et on cesse d'attendre après DOWNLOAD_TIMEOUT
+download_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pytube")
+
+# La recherche et le téléchargement ont des latences normales très différentes.
+# Les vidéos privées ou indisponibles ne comptent pas comme des pannes.
+search_breaker = CircuitBreaker(
+    "youtube_search",
+    slow_call_seconds=5.0,
+    failure_exceptions=NETWORK_EXCEPTIONS + (httpx.TransportError,)
+)
+download_breaker = CircuitBreaker("youtube_download", slow_call_seconds=40.0)
+
+class DownloadOverloadedError(Exception):
+    """Aucun worker de téléchargement libre: surcharge locale, pas une panne de YouTube"""
+
 def extract_video_id(url):
     """
     Extrait l'ID vidéo d'une URL YouTube
@@ -27,8 +52,9 @@ def search_youtube(query, limit=5):
     """
     logger.info(f"Recherche YouTube pour: {query}")
     try:
-        videos_search = VideosSearch(query, limit=limit)
-        results = videos_search.result()
+        with search_breaker.guard():
+            videos_search = VideosSearch(query, limit=limit, timeout=SEARCH_TIMEOUT)
+            results = videos_search.result()
         
         # Formater les résultats pour une utilisation facile
         formatted_results = []
@@ -57,6 +83,57 @@ def search_youtube(query, limit=5):
         logger.error(f"Erreur lors de la recherche YouTube: {e}")
         raise
 
+def _download_stream(call, video_url, video_id, temp_dir, max_size_mb):
+    """
+    Sélectionne et télécharge le flux respectant la limite de taille (exécuté dans download_executor)
+    """
+    # La latence mesurée par le disjoncteur exclut l'attente dans la file
+    call.start()
+    yt = pytube.YouTube(video_url)
+    
+    # Obtenir les flux disponibles
+    streams = yt.streams.filter(progressive=True, file_extension='mp4')
+    
+    # Trier par résolution (de la plus basse à la plus haute)
+    streams = sorted(streams, key=lambda x: int(x.resolution[:-1]) if x.resolution else 0)
+    
+    # Trouver le flux qui respecte la limite de taille
+    selected_stream = None
+    for stream in streams:
+        # Estimer la taille en Mo
+        size_mb = stream.filesize / (1024 * 1024)
+        logger.info(f"Flux disponible: {stream.resolution}, {size_mb:.2f} Mo")
+        
+        if size_mb <= max_size_mb:
+            selected_stream = stream
+        else:
+            # Si on dépasse la limite, on prend le dernier flux valide
+            break
+    
+    if not selected_stream and streams:
+        # Si aucun flux ne respecte la limite, prendre le plus petit
+        selected_stream = streams[0]
+        logger.warning(f"Aucun flux ne respecte la limite de {max_size_mb}Mo, utilisation du plus petit: {selected_stream.resolution}")
+    
+    if not selected_stream:
+        logger.error("Aucun flux vidéo trouvé")
+        raise Exception("Aucun flux vidéo disponible")
+    
+    # Télécharger la vidéo
+    logger.info(f"Téléchargement du flux {selected_stream.resolution}, taille estimée: {selected_stream.filesize / (1024 * 1024):.2f} Mo")
+    selected_stream.download(output_path=temp_dir, filename=f"{video_id}.mp4", timeout=DOWNLOAD_SOCKET_TIMEOUT)
+
+def _remove_file(path):
+    """
+    Supprime le fichier d'un téléchargement abandonné
+    """
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Fichier d'un téléchargement abandonné supprimé: {path}")
+    except OSError as e:
+        logger.warning(f"Impossible de supprimer le fichier temporaire: {e}")
+
 def download_youtube_video(video_id, max_size_mb=25):
     """
     Télécharge une vidéo YouTube et retourne le chemin du fichier.
@@ -68,40 +145,16 @@ def download_youtube_video(video_id, max_size_mb=25):
     
     logger.info(f"Téléchargement de la vidéo: {video_id}")
     try:
-        # Télécharger la vidéo
-        yt = pytube.YouTube(video_url)
-        
-        # Obtenir les flux disponibles
-        streams = yt.streams.filter(progressive=True, file_extension='mp4')
-        
-        # Trier par résolution (de la plus basse à la plus haute)
-        streams = sorted(streams, key=lambda x: int(x.resolution[:-1]) if x.resolution else 0)
-        
-        # Trouver le flux qui respecte la limite de taille
-        selected_stream = None
-        for stream in streams:
-            # Estimer la taille en Mo
-            size_mb = stream.filesize / (1024 * 1024)
-            logger.info(f"Flux disponible: {stream.resolution}, {size_mb:.2f} Mo")
-            
-            if size_mb <= max_size_mb:
-                selected_stream = stream
-            else:
-                # Si on dépasse la limite, on prend le dernier flux valide
-                break
-        
-        if not selected_stream and streams:
-            # Si aucun flux ne respecte la limite, prendre le plus petit
-            selected_stream = streams[0]
-            logger.warning(f"Aucun flux ne respecte la limite de {max_size_mb}Mo, utilisation du plus petit: {selected_stream.resolution}")
-        
-        if not selected_stream:
-            logger.error("Aucun flux vidéo trouvé")
-            raise Exception("Aucun flux vidéo disponible")
-        
-        # Télécharger la vidéo
-        logger.info(f"Téléchargement du flux {selected_stream.resolution}, taille estimée: {selected_stream.filesize / (1024 * 1024):.2f} Mo")
-        selected_stream.download(output_path=temp_dir, filename=f"{video_id}.mp4")
+        with download_breaker.guard() as call:
+            future = download_executor.submit(_download_stream, call, video_url, video_id, temp_dir, max_size_mb)
+            if not call.started.wait(DOWNLOAD_QUEUE_TIMEOUT) and future.cancel():
+                raise DownloadOverloadedError("Tous les workers de téléchargement sont occupés")
+            try:
+                future.result(timeout=DOWNLOAD_TIMEOUT)
+            except FutureTimeoutError:
+                # Le thread continue: supprimer le fichier quand il aura fini
+                future.add_done_callback(lambda _: _remove_file(output_path))
+                raise
         
         # Vérifier la taille du fichier
         file_size_mb = os.path.getsize(output_path) / (1024 * 1024)
@@ -114,4 +167,3 @@ def download_youtube_video(video_id, max_size_mb=25):
     except Exception as e:
         logger.error(f"Erreur lors du téléchargement de la vidéo: {e}")
         raise
-